@@ -1,11 +1,19 @@
+import asyncio
 import logging
 import subprocess
 import sqlite3
 import os
+import re
+import threading
+from bisect import bisect_left
+from collections import namedtuple
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackContext, MessageHandler, Job, filters, CallbackQueryHandler
+from telegram.ext import AIORateLimiter, Application, CommandHandler, CallbackContext, MessageHandler, Job, filters, CallbackQueryHandler
+
+import scraper
 
 # Enable logging
 logging.basicConfig(
@@ -30,6 +38,40 @@ station_table_mapping = {
     "Ormidia Industrial Station": "station11"
 }
 
+# Lowercased station names for case-insensitive /check lookups
+STATIONS_LOWER = tuple((station.lower(), station) for station in station_table_mapping)
+
+# Per-table query strings, built once so handlers don't re-format SQL on every call.
+# Rows are only ever appended, so the latest rows are found via a MAX(id) primary key lookup
+LATEST_SQL = {
+    table_name: f"SELECT * FROM {table_name} WHERE id = (SELECT MAX(id) FROM {table_name})"
+    for table_name in station_table_mapping.values()
+}
+LAST5_SQL = {
+    table_name: f"SELECT id, update_time FROM {table_name} WHERE id > (SELECT MAX(id) - 5 FROM {table_name}) ORDER BY id DESC"
+    for table_name in station_table_mapping.values()
+}
+
+# Single query returning the latest row of every station table, tagged with the station name
+LATEST_ROWS_SQL = " UNION ALL ".join(
+    f"SELECT '{station_name}' AS station_name, * FROM {table_name} WHERE id = (SELECT MAX(id) FROM {table_name})"
+    for station_name, table_name in station_table_mapping.items()
+)
+
+# Maximum number of hourly notifications in flight at once; the send rate itself
+# (Telegram allows ~30 messages/second) is enforced by the application's rate limiter
+SEND_CONCURRENCY = 30
+
+# Number of times a request rejected with RetryAfter (HTTP 429) is retried after the requested wait
+SEND_MAX_RETRIES = 3
+
+# Statuses that trigger a notification for each restrictive filter ('all' sends every status)
+FILTER_SETS = {
+    'yellow_up': frozenset({'🟡', '🟠', '🔴'}),
+    'orange_up': frozenset({'🟠', '🔴'}),
+    'red_only': frozenset({'🔴'})
+}
+
 # Mapping of pollutant labels for bot message
 key_mapping = {
     "status": "Status",
@@ -45,6 +87,14 @@ key_mapping = {
     "update_time": "Timestamp"
 }
 
+# Station table columns after the id, in table order
+StationRow = namedtuple('StationRow', 'status pm_10 pm_2_5 o3 no no2 nox so2 co c6h6 update_time')
+
+# Pollutant columns in display order, paired with their message labels
+# (positions index into StationRow)
+POLLUTANT_KEYS = ('pm_10', 'pm_2_5', 'o3', 'no', 'no2', 'nox', 'so2', 'co', 'c6h6')
+POLLUTANT_LABELS = tuple((StationRow._fields.index(key), key_mapping[key]) for key in POLLUTANT_KEYS)
+
 # Pollutant thresholds based on official Cyprus Air Quality standards (μg/m³)
 # Source: https://www.airquality.dli.mlsi.gov.cy/
 # Levels: Low (1), Moderate (2), High (3), Very High (4 = above high threshold)
@@ -58,31 +108,34 @@ pollutant_thresholds = {
     "c6h6": {"low": 5, "moderate": 10, "high": 15}           # C6H6: 0-5 Low, 5-10 Mod, 10-15 High, >15 Very High
 }
 
-def analyze_air_quality(data_dict):
-    """Analyze air quality data and generate descriptive message."""
-    status = data_dict.get('status', '')
-    messages = []
-    
-    # Parse numeric values from strings (handles values with units like "69.6 μg/m³")
-    def parse_value(val):
-        if val and val != 'None':
-            try:
-                # Remove units by taking only the numeric part before any space
-                # Also handle comma as decimal separator
-                numeric_part = val.split()[0] if ' ' in val else val
-                return float(numeric_part.replace(',', '.'))
-            except:
-                return None
+# Thresholds flattened into (key, StationRow position, (low, moderate, high)) tuples, in reporting order
+THRESH_ORDER = tuple(
+    (key, StationRow._fields.index(key), (levels["low"], levels["moderate"], levels["high"]))
+    for key, levels in pollutant_thresholds.items()
+)
+
+# Level labels indexed by the number of thresholds a value exceeds
+LEVEL_LABELS = (None, 'moderate', 'high', 'very high')
+
+# Leading number of a pollutant value, with either a dot or a comma as decimal separator
+NUMERIC_RE = re.compile(r'[-+]?\d+(?:[.,]\d+)?')
+
+def parse_value(val):
+    """Parse a numeric value from a string (handles values with units like "69.6 μg/m³")."""
+    if not val or val == 'None':
         return None
+    # Fast path for values that are already plain numbers
+    try:
+        return float(val)
+    except ValueError:
+        match = NUMERIC_RE.search(val)
+        return float(match.group(0).replace(',', '.')) if match else None
+
+def analyze_air_quality(row):
+    """Analyze a StationRow and generate descriptive message."""
+    status = row.status
+    messages = []
     
-    pm10 = parse_value(data_dict.get('pm_10'))
-    pm25 = parse_value(data_dict.get('pm_2_5'))
-    o3 = parse_value(data_dict.get('o3'))
-    no2 = parse_value(data_dict.get('no2'))
-    so2 = parse_value(data_dict.get('so2'))
-    co = parse_value(data_dict.get('co'))
-    c6h6 = parse_value(data_dict.get('c6h6'))
-
     # Pollutant health impact descriptions (based on Cyprus Air Quality guidelines)
     # Source: https://www.airquality.dli.mlsi.gov.cy/
     health_impacts = {
@@ -110,61 +163,15 @@ def analyze_air_quality(data_dict):
     high_pollutants = []
     moderate_pollutants = []
 
-    if pm10:
-        if pm10 > pollutant_thresholds['pm_10']['high']:
-            high_pollutants.append(('pm_10', pm10, 'very high'))
-        elif pm10 > pollutant_thresholds['pm_10']['moderate']:
-            high_pollutants.append(('pm_10', pm10, 'high'))
-        elif pm10 > pollutant_thresholds['pm_10']['low']:
-            moderate_pollutants.append(('pm_10', pm10, 'moderate'))
-
-    if pm25:
-        if pm25 > pollutant_thresholds['pm_2_5']['high']:
-            high_pollutants.append(('pm_2_5', pm25, 'very high'))
-        elif pm25 > pollutant_thresholds['pm_2_5']['moderate']:
-            high_pollutants.append(('pm_2_5', pm25, 'high'))
-        elif pm25 > pollutant_thresholds['pm_2_5']['low']:
-            moderate_pollutants.append(('pm_2_5', pm25, 'moderate'))
-
-    if o3:
-        if o3 > pollutant_thresholds['o3']['high']:
-            high_pollutants.append(('o3', o3, 'very high'))
-        elif o3 > pollutant_thresholds['o3']['moderate']:
-            high_pollutants.append(('o3', o3, 'high'))
-        elif o3 > pollutant_thresholds['o3']['low']:
-            moderate_pollutants.append(('o3', o3, 'moderate'))
-
-    if no2:
-        if no2 > pollutant_thresholds['no2']['high']:
-            high_pollutants.append(('no2', no2, 'very high'))
-        elif no2 > pollutant_thresholds['no2']['moderate']:
-            high_pollutants.append(('no2', no2, 'high'))
-        elif no2 > pollutant_thresholds['no2']['low']:
-            moderate_pollutants.append(('no2', no2, 'moderate'))
-
-    if so2:
-        if so2 > pollutant_thresholds['so2']['high']:
-            high_pollutants.append(('so2', so2, 'very high'))
-        elif so2 > pollutant_thresholds['so2']['moderate']:
-            high_pollutants.append(('so2', so2, 'high'))
-        elif so2 > pollutant_thresholds['so2']['low']:
-            moderate_pollutants.append(('so2', so2, 'moderate'))
-
-    if co:
-        if co > pollutant_thresholds['co']['high']:
-            high_pollutants.append(('co', co, 'very high'))
-        elif co > pollutant_thresholds['co']['moderate']:
-            high_pollutants.append(('co', co, 'high'))
-        elif co > pollutant_thresholds['co']['low']:
-            moderate_pollutants.append(('co', co, 'moderate'))
-
-    if c6h6:
-        if c6h6 > pollutant_thresholds['c6h6']['high']:
-            high_pollutants.append(('c6h6', c6h6, 'very high'))
-        elif c6h6 > pollutant_thresholds['c6h6']['moderate']:
-            high_pollutants.append(('c6h6', c6h6, 'high'))
-        elif c6h6 > pollutant_thresholds['c6h6']['low']:
-            moderate_pollutants.append(('c6h6', c6h6, 'moderate'))
+    for key, position, bounds in THRESH_ORDER:
+        value = parse_value(row[position])
+        if not value:
+            continue
+        # Number of thresholds strictly below the value: 0 (low) to 3 (very high)
+        level = bisect_left(bounds, value)
+        if level:
+            target = high_pollutants if level > 1 else moderate_pollutants
+            target.append((key, value, LEVEL_LABELS[level]))
 
     # Generate descriptive message based on status and pollutants
     # Health recommendations based on official Cyprus Air Quality guidelines
@@ -222,13 +229,13 @@ def analyze_air_quality(data_dict):
         # Add source information for the most elevated pollutant
         messages.append("")  # Blank line
         dominant_pollutants = high_pollutants if high_pollutants else moderate_pollutants
-        top_pollutant = dominant_pollutants[0][0]  # Get the key of the most concerning pollutant
+        top_pollutant, top_value = dominant_pollutants[0][:2]  # Get the key and value of the most concerning pollutant
 
         # Add appropriate emoji and source info
         if top_pollutant in ['pm_10', 'pm_2_5']:
             messages.append(f"💨 Typical sources: {pollutant_sources[top_pollutant]}")
             # Add specific dust storm context for Cyprus when PM10 is high
-            if top_pollutant == 'pm_10' and pm10 and pm10 > 100:
+            if top_pollutant == 'pm_10' and top_value > 100:
                 messages.append("🌍 Note: Cyprus periodically affected by African/Middle Eastern dust")
         elif top_pollutant == 'o3':
             messages.append(f"☀️ Formation: {pollutant_sources[top_pollutant]}")
@@ -243,9 +250,46 @@ def analyze_air_quality(data_dict):
 
     return '\n'.join(messages) if messages else None
 
+# Rows carry their id and update time, so a newly scraped row is a cache miss
+# while repeated requests within the same hour reuse the formatted message
+@lru_cache(maxsize=64)
+def format_station_message(data):
+    """Build the status emoji and full message text for a station row."""
+    # Skip the id column
+    row = StationRow(*data[1:])
+    
+    # Generate descriptive message
+    descriptive_msg = analyze_air_quality(row)
+    
+    # Combine status, descriptive message, and data
+    # Start with status emoji
+    status_line = f"Status: {row.status}"
+    
+    # Build the message: status first, then description, then parameters
+    message_parts = [status_line]
+    
+    if descriptive_msg:
+        message_parts.append(descriptive_msg)
+    
+    # Add pollutant data (excluding status and timestamp)
+    message_parts.append('\n'.join(f"{label}: {row[position]}" for position, label in POLLUTANT_LABELS))
+    
+    # Add timestamp at the end
+    message_parts.append(f"Timestamp: {row.update_time}")
+    
+    return row.status, '\n\n'.join(message_parts)
+
 # Connect to the SQLite database
 conn = sqlite3.connect("subscribers.db")
 cur = conn.cursor()
+# Rollback journal, not WAL: only subscribers.db itself is bind-mounted, so a WAL file would stay
+# in the container and its uncheckpointed writes would be lost on a crash and redeploy.
+# journal_mode is persistent, so this also switches back a file already left in WAL mode.
+# synchronous stays at the default FULL, which rollback-journal mode needs to survive power loss
+cur.execute("PRAGMA journal_mode=DELETE")
+# Keep temporary tables and a larger page cache in memory
+cur.execute("PRAGMA temp_store=MEMORY")
+cur.execute("PRAGMA cache_size=-20000")
 # Create the subscribers table if it doesn't exist
 cur.execute('''CREATE TABLE IF NOT EXISTS subscribers (
                 user_id INTEGER PRIMARY KEY,
@@ -255,38 +299,43 @@ cur.execute('''CREATE TABLE IF NOT EXISTS subscribers (
 conn.commit()
 
 # Add status_filter column if it doesn't exist (for existing databases)
-try:
+subscriber_columns = {column[1] for column in cur.execute("PRAGMA table_info(subscribers)").fetchall()}
+if 'status_filter' not in subscriber_columns:
     cur.execute("ALTER TABLE subscribers ADD COLUMN status_filter TEXT DEFAULT 'all'")
     conn.commit()
-except sqlite3.OperationalError:
-    # Column already exists
-    pass
 
-# Load the initial list of subscribers from the database
-cur.execute("SELECT user_id FROM subscribers")
-initial_subscribers = cur.fetchall()
-subscribed_users = set(user_id for user_id, in initial_subscribers)
+# user_id is the rowid, so per-user lookups never need a secondary index;
+# remove the one earlier versions created, which only added work to every write
+cur.execute("DROP INDEX IF EXISTS idx_sub_user_filter")
+conn.commit()
+
+# Shared read-only connection to the stations database written by the scraper
+stations_conn = sqlite3.connect("stations.db", check_same_thread=False)
+stations_conn.execute("PRAGMA query_only=ON")
+stations_lock = threading.Lock()
+
+# Load subscribers from the database once; handlers keep this in sync with every write
+# so the hourly broadcast needs no database reads: user_id -> (selected_station, status_filter)
+cur.execute("SELECT user_id, selected_station, COALESCE(status_filter, 'all') FROM subscribers")
+subscriber_cache = {user_id: (station, status_filter) for user_id, station, status_filter in cur.fetchall()}
+
+# Reply keyboards are the same for every user, so build them once
+# Station keyboard from station_table_mapping keys - one station per row
+STATION_KEYBOARD = ReplyKeyboardMarkup([[station] for station in station_table_mapping], one_time_keyboard=True)
+
+# Inline keyboard for filter options
+FILTER_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("All statuses", callback_data='filter_all')],
+    [InlineKeyboardButton("🟡 Yellow and above", callback_data='filter_yellow_up')],
+    [InlineKeyboardButton("🟠 Orange and above", callback_data='filter_orange_up')],
+    [InlineKeyboardButton("🔴 Red only", callback_data='filter_red_only')]
+])
 
 # Define commands
 async def start(update: Update, context: CallbackContext) -> str:
-    # Create keyboard from station_table_mapping keys - one station per row
-    keyboard = [
-        ["Nicosia: Traffic Station"],
-        ["Nicosia: Residential Station"],
-        ["Limassol: Traffic Station"],
-        ["Larnaca: Traffic Station"],
-        ["Paphos: Traffic Station"],
-        ["Ayia Marina Xyliatou: Background Station"],
-        ["Zygi: Industrial Station"],
-        ["Mari: Industrial Station"],
-        ["Paralimni: Traffic Station"],
-        ["Kalavasos Industrial Station"],
-        ["Ormidia Industrial Station"]
-    ]
-    
     await update.message.reply_text(
         "Please select a station:",
-        reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True),
+        reply_markup=STATION_KEYBOARD,
     )
 
     return "SELECTED_STATION"
@@ -314,18 +363,6 @@ async def select_station(update: Update, context: CallbackContext) -> None:
         # Retrieve the selected station from the user's message
         selected_station = update.message.text
         
-        # TEMPORARY DEBUG
-        if selected_station == "/test":
-            await update.message.reply_text("DEBUG: /test command received in select_station")
-            return
-        if selected_station == "/check":
-            await update.message.reply_text("DEBUG: /check command received in select_station")
-            return
-        
-        # Skip if this is a command
-        if selected_station.startswith('/'):
-            return
-            
         # Check if the selected station is in the station mapping
         if selected_station in station_table_mapping:
             logger.info(f"Valid station selected: {selected_station}")
@@ -337,44 +374,11 @@ async def select_station(update: Update, context: CallbackContext) -> None:
                 await update.message.reply_text("Please enter the correct name or use the command keyboard.")
                 return
 
-            # Connect to the SQLite database
-            conn = sqlite3.connect("stations.db")
-            cur = conn.cursor()
             # Fetch the latest row from the table for the selected station
-            cur.execute(f"SELECT * FROM {table_name} ORDER BY id DESC LIMIT 1")
-            data = cur.fetchone()
-            # Close the database connection
-            conn.close()
+            with stations_lock:
+                data = stations_conn.execute(LATEST_SQL[table_name]).fetchone()
             if data:
-                # Create data dictionary for analysis
-                data_dict = dict(zip(['status', 'pm_10', 'pm_2_5', 'o3', 'no', 'no2', 'nox', 'so2', 'co', 'c6h6', 'update_time'], data[1:]))
-                
-                # Generate descriptive message
-                descriptive_msg = analyze_air_quality(data_dict)
-                
-                # Combine status, descriptive message, and data
-                # Start with status emoji
-                status_line = f"Status: {data_dict.get('status', '')}"
-                
-                # Build the message: status first, then description, then parameters
-                message_parts = [status_line]
-                
-                if descriptive_msg:
-                    message_parts.append(descriptive_msg)
-                
-                # Add pollutant data (excluding status and timestamp)
-                pollutant_data = []
-                for key, value in data_dict.items():
-                    if key not in ['status', 'update_time']:
-                        pollutant_data.append(f"{key_mapping.get(key, key)}: {value}")
-                
-                if pollutant_data:
-                    message_parts.append('\n'.join(pollutant_data))
-                
-                # Add timestamp at the end
-                message_parts.append(f"Timestamp: {data_dict.get('update_time', '')}")
-                
-                full_message = '\n\n'.join(message_parts)
+                _, full_message = format_station_message(data)
                 
                 # Send the data as a response to the user
                 await update.message.reply_text(f"{full_message}\n\nUse /subscribe for hourly updates, or /filter for alerts only.")
@@ -395,7 +399,8 @@ async def subscribe(update: Update, context: CallbackContext) -> None:
         try:
             cur.execute("INSERT OR IGNORE INTO subscribers (user_id, selected_station) VALUES (?, ?)", (user_id, selected_station))
             conn.commit()
-            subscribed_users.add(user_id)
+            # Mirror INSERT OR IGNORE: an existing subscription keeps its settings
+            subscriber_cache.setdefault(user_id, (selected_station, 'all'))
             await update.message.reply_text('You are now subscribed to hourly updates.')
         except Exception as e:
             logger.error(f"An error occurred while subscribing user {user_id}: {e}")
@@ -405,8 +410,8 @@ async def subscribe(update: Update, context: CallbackContext) -> None:
 # Define the /unsubscribe command handler
 async def unsubscribe(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    if user_id in subscribed_users:
-        subscribed_users.remove(user_id)
+    if user_id in subscriber_cache:
+        del subscriber_cache[user_id]
         await update.message.reply_text('You have unsubscribed from hourly updates.')
         # Update the subscribers table in the database
         cur.execute("DELETE FROM subscribers WHERE user_id = ?", (user_id,))
@@ -426,13 +431,10 @@ async def check_data(update: Update, context: CallbackContext) -> None:
     if context.args:
         # Join all arguments to handle station names with spaces
         station_name = ' '.join(context.args)
-        selected_station = None
         
         # Find matching station (case insensitive partial match)
-        for station in station_table_mapping.keys():
-            if station_name.lower() in station.lower():
-                selected_station = station
-                break
+        needle = station_name.lower()
+        selected_station = next((station for lowered, station in STATIONS_LOWER if needle in lowered), None)
         
         if not selected_station:
             # Show available stations
@@ -457,19 +459,12 @@ async def check_data(update: Update, context: CallbackContext) -> None:
         return
     
     # Get last 5 entries from the database
-    station_conn = sqlite3.connect("stations.db")
-    station_cur = station_conn.cursor()
-    
-    station_cur.execute(f"SELECT id, update_time FROM {table_name} ORDER BY id DESC LIMIT 5")
-    rows = station_cur.fetchall()
-    
-    station_conn.close()
+    with stations_lock:
+        rows = stations_conn.execute(LAST5_SQL[table_name]).fetchall()
     
     if rows:
-        message = f"Last 5 entries for {selected_station}:\n\n"
-        for row in rows:
-            message += f"ID: {row[0]} - Time: {row[1]}\n"
-        message += f"\nCurrent time: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+        entries = '\n'.join(f"ID: {row[0]} - Time: {row[1]}" for row in rows)
+        message = f"Last 5 entries for {selected_station}:\n\n{entries}\n\nCurrent time: {datetime.now():%d/%m/%Y %H:%M}"
     else:
         message = "No data found in database"
     
@@ -487,18 +482,9 @@ async def filter_command(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text('Please subscribe first using /start and /subscribe commands.')
         return
     
-    # Create inline keyboard for filter options
-    keyboard = [
-        [InlineKeyboardButton("All statuses", callback_data='filter_all')],
-        [InlineKeyboardButton("🟡 Yellow and above", callback_data='filter_yellow_up')],
-        [InlineKeyboardButton("🟠 Orange and above", callback_data='filter_orange_up')],
-        [InlineKeyboardButton("🔴 Red only", callback_data='filter_red_only')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
         'Select which air quality statuses you want to be notified about:',
-        reply_markup=reply_markup
+        reply_markup=FILTER_MARKUP
     )
 
 # Callback handler for filter buttons
@@ -513,6 +499,8 @@ async def filter_callback(update: Update, context: CallbackContext) -> None:
     try:
         cur.execute("UPDATE subscribers SET status_filter = ? WHERE user_id = ?", (filter_type, user_id))
         conn.commit()
+        if user_id in subscriber_cache:
+            subscriber_cache[user_id] = (subscriber_cache[user_id][0], filter_type)
         
         # Send confirmation message
         filter_descriptions = {
@@ -565,93 +553,33 @@ async def send_hourly_message(context: CallbackContext) -> None:
     station_data = {}
     
     try:
-        station_conn = sqlite3.connect("stations.db")
-        station_cur = station_conn.cursor()
-        
         # Fetch latest data for all stations
-        for station_name, table_name in station_table_mapping.items():
-            station_cur.execute(f"SELECT * FROM {table_name} ORDER BY id DESC LIMIT 1")
-            data = station_cur.fetchone()
-            if data:
-                # Create data dictionary for analysis
-                data_dict = dict(zip(['status', 'pm_10', 'pm_2_5', 'o3', 'no', 'no2', 'nox', 'so2', 'co', 'c6h6', 'update_time'], data[1:]))
-                
-                # Generate descriptive message
-                descriptive_msg = analyze_air_quality(data_dict)
-                
-                # Combine status, descriptive message, and data
-                # Start with status emoji
-                status_line = f"Status: {data_dict.get('status', '')}"
-                
-                # Build the message: status first, then description, then parameters
-                message_parts = [status_line]
-                
-                if descriptive_msg:
-                    message_parts.append(descriptive_msg)
-                
-                # Add pollutant data (excluding status and timestamp)
-                pollutant_data = []
-                for key, value in data_dict.items():
-                    if key not in ['status', 'update_time']:
-                        pollutant_data.append(f"{key_mapping.get(key, key)}: {value}")
-                
-                if pollutant_data:
-                    message_parts.append('\n'.join(pollutant_data))
-                
-                # Add timestamp at the end
-                message_parts.append(f"Timestamp: {data_dict.get('update_time', '')}")
-                
-                full_message = '\n\n'.join(message_parts)
-                
-                station_data[station_name] = {
-                    'message': full_message,
-                    'status': data_dict.get('status', '')
-                }
+        with stations_lock:
+            latest_rows = stations_conn.execute(LATEST_ROWS_SQL).fetchall()
         
-        station_conn.close()
+        # Map each station to its (status, message) tuple, shared with the select_station cache
+        for row in latest_rows:
+            station_data[row[0]] = format_station_message(row[1:])
         
     except Exception as e:
         logger.error(f"Error fetching station data: {e}")
         return
     
-    # Now send messages to users
-    users_sent = 0
+    # Now send messages to users, overlapping the network round-trips
+    semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
     
-    for user_id in subscribed_users:
+    async def send_to_user(user_id, selected_station, status_filter) -> bool:
         try:
-            # Fetch the selected station for the current user from the database
-            cur.execute("SELECT selected_station FROM subscribers WHERE user_id = ?", (user_id,))
-            row = cur.fetchone()
-            if not row:
-                logger.error(f"No selected station found for user {user_id}")
-                continue
-            
-            selected_station = row[0]
-            
             # Get pre-formatted data
             if selected_station in station_data:
-                # Check status filter
-                cur.execute("SELECT status_filter FROM subscribers WHERE user_id = ?", (user_id,))
-                filter_result = cur.fetchone()
-                status_filter = filter_result[0] if filter_result else 'all'
-                
-                # Get status from the station data
-                status_emoji = station_data[selected_station]['status']
+                # Get status and message from the station data
+                status_emoji, message = station_data[selected_station]
                 
                 # Check if we should send based on filter
-                should_send = False
-                if status_filter == 'all':
-                    should_send = True
-                elif status_filter == 'yellow_up' and status_emoji in ['🟡', '🟠', '🔴']:
-                    should_send = True
-                elif status_filter == 'orange_up' and status_emoji in ['🟠', '🔴']:
-                    should_send = True
-                elif status_filter == 'red_only' and status_emoji == '🔴':
-                    should_send = True
-                
-                if should_send:
-                    await context.bot.send_message(user_id, station_data[selected_station]['message'])
-                    users_sent += 1
+                if status_filter == 'all' or status_emoji in FILTER_SETS.get(status_filter, ()):
+                    async with semaphore:
+                        await context.bot.send_message(user_id, message)
+                    return True
                 else:
                     logger.info(f"Skipping notification for user {user_id} - status {status_emoji} doesn't match filter {status_filter}")
             else:
@@ -659,25 +587,30 @@ async def send_hourly_message(context: CallbackContext) -> None:
                 
         except Exception as e:
             logger.error(f"Error sending hourly message to user {user_id}: {e}")
+        return False
+    
+    results = await asyncio.gather(
+        *(send_to_user(user_id, *settings) for user_id, settings in subscriber_cache.items()),
+        return_exceptions=True
+    )
+    users_sent = sum(result is True for result in results)
     
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
     logger.info(f"Hourly notifications complete: {users_sent} users in {duration:.2f} seconds")
 
+# Function to scrape the stations page into stations.db from the bot's job queue
+async def scrape_job(context: CallbackContext) -> None:
+    await scraper.scrape_and_save_data_async()
+
 # Function to schedule the hourly job at specific minutes after the hour
 def schedule_hourly_job(context: CallbackContext) -> None:
-    now = datetime.now()
-    # Set notifications to run at :25 past each hour (5 minutes after scraper runs at :20)
+    # Set notifications to run at :25 past each hour (5 minutes after the scrape at :20)
     target_minute = 25
     
-    # Calculate the next run time at :25 past the hour
-    if now.minute >= target_minute:
-        next_run = now.replace(hour=now.hour+1, minute=target_minute, second=0, microsecond=0)
-    else:
-        next_run = now.replace(minute=target_minute, second=0, microsecond=0)
-    
-    # Calculate delay until first run
-    delay = (next_run - now).total_seconds()
+    # Calculate delay until the next run at :25 past the hour
+    delay = scraper.seconds_until_minute(target_minute)
+    next_run = datetime.now() + timedelta(seconds=delay)
     
     # Schedule the repeating job
     context.job_queue.run_repeating(send_hourly_message, interval=3600, first=delay)
@@ -691,7 +624,8 @@ def main() -> None:
         return
 
     # Pass token
-    application = Application.builder().token(token).build()
+    # Throttle every request to Telegram's rate limits and wait out RetryAfter instead of dropping the message
+    application = Application.builder().token(token).rate_limiter(AIORateLimiter(max_retries=SEND_MAX_RETRIES)).build()
     
     # Handle commands
     application.add_handler(CommandHandler("start", start))
@@ -707,8 +641,12 @@ def main() -> None:
     # Handle callback queries for inline keyboards
     application.add_handler(CallbackQueryHandler(filter_callback, pattern='^filter_'))
 
-    # Handle messages from ReplyKeyboardMarkup
-    application.add_handler(MessageHandler(filters.TEXT, select_station))
+    # Handle messages from ReplyKeyboardMarkup (commands never reach this handler)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, select_station))
+
+    # Scrape once at startup, then every hour at :20 past in the same event loop
+    application.job_queue.run_once(scrape_job, 0)
+    application.job_queue.run_repeating(scrape_job, interval=3600, first=scraper.seconds_until_minute(scraper.SCRAPE_MINUTE))
 
     # Schedule the hourly job with specific timing instead of immediate start
     application.job_queue.run_once(schedule_hourly_job, 0)
@@ -716,8 +654,12 @@ def main() -> None:
     # Run the bot until the user presses Ctrl-C
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
-    # Close the database connection when the bot stops
+    # Close the database connections when the bot stops
     conn.close()
+    stations_conn.close()
+    # Wait for a scrape still running in a worker thread before closing its connection
+    with scraper.scrape_lock:
+        scraper.conn.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,25 +1,49 @@
+import asyncio
+import logging
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree, html
 import sqlite3
 import os
-import schedule
-import time
-from datetime import datetime
-
-# Function to map group status to emojis
-def status_to_emoji(status):
-    if status == "station-status-green":
-        return "🟢"
-    elif status == "station-status-yellow":
-        return "🟡"
-    elif status == "station-status-orange":
-        return "🟠"
-    elif status == "station-status-red":
-        return "🔴"
-    elif status == "station-status-white":
-        return "⚪"
-    else:
-        return "❓"
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Enable logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Mapping of group status classes to emojis
+STATUS_EMOJI = {
+    "station-status-green": "🟢",
+    "station-status-yellow": "🟡",
+    "station-status-orange": "🟠",
+    "station-status-red": "🔴",
+    "station-status-white": "⚪"
+}
+
+# XPath predicate matching elements that carry the given class token
+def has_class(class_name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {class_name} ")'
+
+# Page structure queries, compiled once and evaluated directly on the lxml tree
+HTML_PARSER = html.HTMLParser(encoding="utf-8")
+CONTAINER_XPATH = etree.XPath('//div[@id="views-bootstrap-frontpage-stations-overview-block-1"]')
+# Station divs: any div whose first or later class starts with "col"
+STATION_DIVS_XPATH = etree.XPath('.//div[contains(concat(" ", normalize-space(@class)), " col")]')
+MAINTENANCE_XPATH = etree.XPath(f'.//span[{has_class("under-maintenance-label")}]')
+TITLE_XPATH = etree.XPath(f'.//h4[{has_class("stations-overview-title")}]')
+STATUS_XPATH = etree.XPath(f'.//span[{has_class("group-status-helper-wrapper")}]//span')
+LABELS_XPATH = etree.XPath(f'.//span[{has_class("pollutant-label")}]')
+VALUES_XPATH = etree.XPath(f'.//span[{has_class("pollutant-value")}]')
+UPDATE_TIME_XPATH = etree.XPath(f'.//div[{has_class("views-field-field-station-update-time")}]')
+
+# Pollutant labels as shown on the website, in station table column order
+POLLUTANT_ORDER = ("PM₁₀", "PM₂.₅", "O₃", "NO", "NO₂", "NOx", "SO₂", "CO", "C₆H₆")
 
 # Mapping of station names to table names
 station_table_mapping = {
@@ -36,133 +60,229 @@ station_table_mapping = {
     "Ormidia Industrial Station": "station11"
 }
 
+# Reuse one HTTP session so the TCP/TLS connection is kept alive between scrapes;
+# transient connection failures and 5xx responses are retried with exponential backoff
+SESSION = requests.Session()
+RETRY = Retry(total=3, backoff_factor=2, status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset({"GET"}))
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=RETRY))
+
+# Conditional request headers from the last fully processed response, so an unchanged
+# page comes back as 304 Not Modified instead of being downloaded and parsed again
+conditional_headers = {}
+
+def remember_validators(response):
+    conditional_headers.clear()
+    if response.headers.get("ETag"):
+        conditional_headers["If-None-Match"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        conditional_headers["If-Modified-Since"] = response.headers["Last-Modified"]
+
+# Create or connect to the SQLite database once and keep it open between scrapes
+# (autocommit mode: each scrape manages its own transaction explicitly)
+conn = sqlite3.connect("stations.db", isolation_level=None, check_same_thread=False)
+# WAL turns each commit into a sequential log append; NORMAL drops the extra fsync per commit
+conn.execute("PRAGMA journal_mode=WAL")
+conn.execute("PRAGMA synchronous=NORMAL")
+conn.execute("PRAGMA temp_store=MEMORY")
+conn.execute("PRAGMA cache_size=-8000")
+
+def init_schema(conn):
+    # Create a table for every station if it doesn't exist
+    for table_name in station_table_mapping.values():
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {table_name} (
+                            id INTEGER PRIMARY KEY,
+                            status TEXT,
+                            pm_10 TEXT,
+                            pm_2_5 TEXT,
+                            o3 TEXT,
+                            no TEXT,
+                            no2 TEXT,
+                            nox TEXT,
+                            so2 TEXT,
+                            co TEXT,
+                            c6h6 TEXT,
+                            update_time TEXT
+                        )''')
+        # One row per timestamp; lets inserts skip duplicates without a separate lookup
+        try:
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_update_time ON {table_name}(update_time)")
+        except sqlite3.IntegrityError:
+            logger.warning("%s: duplicate timestamps already stored, unique index not created", table_name)
+
+init_schema(conn)
+
+# Insert statements per station table, built once so SQLite's statement cache can reuse them
+INSERT_SQL = {
+    table_name: f'''INSERT OR IGNORE INTO {table_name} (status, pm_10, pm_2_5, o3, no, no2, nox, so2, co, c6h6, update_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    for table_name in station_table_mapping.values()
+}
+
+# Single query returning the most recent update_time stored for every station table
+# (by id, since the DD/MM/YYYY timestamps don't sort as text)
+LATEST_UPDATE_SQL = " UNION ALL ".join(
+    f"SELECT '{table_name}', update_time FROM {table_name} WHERE id = (SELECT MAX(id) FROM {table_name})"
+    for table_name in station_table_mapping.values()
+)
+
+# Function to extract just the timestamp part (e.g., "24/05/2025 17:00") from an update time element
+def parse_update_time(element):
+    update_time_raw = element.text_content().strip()
+    # The format is usually "Updated on: DD/MM/YYYY HH:MM"
+    if "Updated on:" in update_time_raw:
+        return update_time_raw.replace("Updated on:", "").strip()
+    return update_time_raw
+
+# Held for the whole of a scrape: the startup and hourly runs share one connection and
+# must not overlap, and the bot must not close the connection under a running scrape
+scrape_lock = threading.Lock()
+
 def scrape_and_save_data():
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"\n[{current_time}] Starting data scrape...")
+    # Skip rather than queue up if the previous scrape is still running
+    if not scrape_lock.acquire(blocking=False):
+        logger.warning("Previous scrape still running, skipping.")
+        return
+    try:
+        scrape_and_save_data_unlocked()
+    finally:
+        scrape_lock.release()
+
+def scrape_and_save_data_unlocked():
+    logger.info("Starting data scrape...")
     
     # URL of the webpage to scrape
     url = "https://www.airquality.dli.mlsi.gov.cy/"
 
-    # Send a GET request to the URL
-    response = requests.get(url)
+    # Send a GET request to the URL; a stalled or failing server must not hang the schedule
+    try:
+        response = SESSION.get(url, headers=conditional_headers, timeout=(5, 30))
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error("Failed to fetch %s: %s", url, e)
+        return
+
+    if response.status_code == 304:
+        logger.info("Page not modified since the last scrape, skipping.")
+        return
 
-    # Parse the HTML content
-    soup = BeautifulSoup(response.content, "html.parser")
+    # Parse the HTML content straight into an lxml tree
+    tree = html.fromstring(response.content, parser=HTML_PARSER)
 
     # Find the main container div
-    main_container = soup.find("div", id="views-bootstrap-frontpage-stations-overview-block-1")
+    containers = CONTAINER_XPATH(tree)
 
     # Check if the main container exists
-    if main_container:
-        # Create or connect to the SQLite database
-        db_path = "stations.db"
-        conn = sqlite3.connect(db_path)
+    if containers:
+        main_container = containers[0]
         cur = conn.cursor()
         
         stations_processed = 0
         new_data_inserted = 0
 
-        # Iterate over each station div
-        for index, div in enumerate(main_container.find_all("div", class_=lambda x: x and x.startswith("col")), 1):
+        # Wrap the whole scrape in one transaction (committed on success, rolled back on error)
+        # so all inserts share a single fsync
+        cur.execute("BEGIN IMMEDIATE")
+        with conn:
+            # Load the latest stored timestamp of every station in one round-trip
+            latest_times = dict(cur.execute(LATEST_UPDATE_SQL).fetchall())
 
-            # Check if the station is under maintenance
-            if div.find("span", class_="under-maintenance-label"):
-                print(f"Station {index}: Under maintenance, skipping.")
-                continue
+            # Find the stations shown with data and the timestamp each one shows
+            stations = []
 
-            # Define table name
-            station_name = div.find("h4", class_="stations-overview-title").text.strip()
-            table_name = station_table_mapping.get(station_name)
-            if not table_name:
-                print(f"No table mapping found for station: {station_name}")
-                continue
+            # Iterate over each station div (any div with a class starting with "col")
+            for index, div in enumerate(STATION_DIVS_XPATH(main_container), 1):
 
-            # Create a table for the current station if it doesn't exist
-            cur.execute(f'''CREATE TABLE IF NOT EXISTS {table_name} (
-                            id INTEGER PRIMARY KEY,
-                            status TEXT,
-                            pm_10 TEXT,
-                            pm_2_5 TEXT,
-                            o3 TEXT,
-                            no TEXT,
-                            no2 TEXT,
-                            nox TEXT,
-                            so2 TEXT,
-                            co TEXT,
-                            c6h6 TEXT,
-                            update_time TEXT
-                        )''')
+                # Check if the station is under maintenance
+                if MAINTENANCE_XPATH(div):
+                    logger.info("Station %d: Under maintenance, skipping.", index)
+                    continue
+
+                # Define table name
+                station_name = TITLE_XPATH(div)[0].text_content().strip()
+                table_name = station_table_mapping.get(station_name)
+                if not table_name:
+                    logger.warning("No table mapping found for station: %s", station_name)
+                    continue
+
+                # Find station update time
+                update_time = parse_update_time(UPDATE_TIME_XPATH(div)[0])
+                stations.append((div, station_name, table_name, update_time))
+
+            # Log what the website shows
+            if stations:
+                logger.info("Website shows timestamp: '%s'", stations[0][3])
+
+            # The common "website hasn't updated yet" case: every station shown with data already
+            # has its timestamp stored, so there is nothing to insert. Stations under maintenance
+            # keep an older latest timestamp and must not hold this back
+            if stations and all(latest_times.get(table_name) == update_time for _, _, table_name, update_time in stations):
+                logger.info("No new data since '%s', skipping.", stations[0][3])
+                remember_validators(response)
+                return
+
+            # Parse every new station reading first, then write all new rows in one batch
+            rows_by_table = defaultdict(list)
+
+            for div, station_name, table_name, update_time in stations:
 
-            # Find group status
-            status_element = div.find("span", class_="group-status-helper-wrapper")
-            status_class = status_element.find("span")["class"] if status_element else ""
-            status_emoji = status_to_emoji(status_class[0]) if status_class else ""
-
-            # Find pollutant data
-            pollutant_data = {}
-            for label_span, value_span in zip(
-                div.find_all("span", class_="pollutant-label"),
-                div.find_all("span", class_="pollutant-value")
-            ):
-                pollutant_label = label_span.text.strip().replace(":", "")
-                pollutant_value = value_span.text.strip()
-                pollutant_data[pollutant_label] = pollutant_value
-
-            # Find station update time
-            update_time_raw = div.find("div", class_="views-field-field-station-update-time").text.strip()
-            
-            # Extract just the timestamp part (e.g., "24/05/2025 17:00")
-            # The format is usually "Updated on: DD/MM/YYYY HH:MM"
-            if "Updated on:" in update_time_raw:
-                update_time = update_time_raw.replace("Updated on:", "").strip()
-            else:
-                update_time = update_time_raw
-            
-            # Log what timestamp we found on the website
-            if index == 1:  # Only log once, not for every station
-                print(f"Website shows timestamp: '{update_time}'")
-            
-            # Check if this timestamp already exists in the database
-            cur.execute(f"SELECT COUNT(*) FROM {table_name} WHERE update_time = ?", (update_time,))
-            count = cur.fetchone()[0]
-            
-            if count > 0:
-                print(f"{station_name}: Data for '{update_time}' already exists, skipping.")
-                # Also check what the latest timestamp in DB is
-                cur.execute(f"SELECT update_time FROM {table_name} ORDER BY id DESC LIMIT 1")
-                latest = cur.fetchone()
-                if latest:
-                    print(f"  Latest in DB: '{latest[0]}'")
-            else:
-                # Insert data into the table for the current station
-                cur.execute(f'''INSERT INTO {table_name} (status, pm_10, pm_2_5, o3, no, no2, nox, so2, co, c6h6, update_time)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                            (status_emoji, pollutant_data.get("PM₁₀"), pollutant_data.get("PM₂.₅"), pollutant_data.get("O₃"),
-                             pollutant_data.get("NO"), pollutant_data.get("NO₂"), pollutant_data.get("NOx"), pollutant_data.get("SO₂"),
-                             pollutant_data.get("CO"), pollutant_data.get("C₆H₆"), update_time))
-                print(f"{station_name}: New data inserted for '{update_time}'")
-                new_data_inserted += 1
-            
-            stations_processed += 1
-
-        # Commit the changes and close the connection
-        conn.commit()
-        conn.close()
-
-        print(f"\n[{current_time}] Scraping complete:")
-        print(f"  - Stations processed: {stations_processed}")
-        print(f"  - New data entries: {new_data_inserted}")
+                # Check if this timestamp is already the latest one in the database
+                if latest_times.get(table_name) == update_time:
+                    logger.info("%s: Data for '%s' already exists, skipping.", station_name, update_time)
+                else:
+                    # Find group status
+                    status_elements = STATUS_XPATH(div)
+                    status_class = status_elements[0].get("class", "").split() if status_elements else ""
+                    status_emoji = STATUS_EMOJI.get(status_class[0], "❓") if status_class else ""
+
+                    # Find pollutant data
+                    labels = tuple(span.text_content().strip().replace(":", "") for span in LABELS_XPATH(div))
+                    values = tuple(span.text_content().strip() for span in VALUES_XPATH(div))
+                    if labels == POLLUTANT_ORDER and len(values) == len(POLLUTANT_ORDER):
+                        # Station reports the full set in table order, so values can be used as-is
+                        pollutants = values
+                    else:
+                        # Station measures only some pollutants; place values by label, None for the rest
+                        pollutant_data = dict(zip(labels, values))
+                        pollutants = tuple(pollutant_data.get(label) for label in POLLUTANT_ORDER)
+
+                    # Queue the row for the current station
+                    rows_by_table[table_name].append((status_emoji, *pollutants, update_time))
+                    
+                stations_processed += 1
+
+            # Insert the queued rows; the unique index on update_time makes SQLite drop rows
+            # for timestamps already stored
+            for table_name, rows in rows_by_table.items():
+                cur.executemany(INSERT_SQL[table_name], rows)
+                new_data_inserted += cur.rowcount
+                logger.info("%s: %d of %d new rows inserted", table_name, cur.rowcount, len(rows))
+
+        remember_validators(response)
+
+        # Nothing closes this connection to trigger a checkpoint; fold the WAL back into
+        # the database file, which is the only file bind-mounted out of the container
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        logger.info("Scraping complete: %d stations processed, %d new data entries", stations_processed, new_data_inserted)
     else:
-        print(f"[{current_time}] ERROR: Data not found on the webpage.")
+        logger.error("Data not found on the webpage.")
 
-# Schedule the scraping function to run once per hour
 # Run at :20 since website has updated by :19 based on user observation
-schedule.every().hour.at(":20").do(scrape_and_save_data)
+SCRAPE_MINUTE = 20
+
+# Function to calculate the delay until the next run at a given minute past the hour
+def seconds_until_minute(minute):
+    now = datetime.now()
+    next_run = now.replace(minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(hours=1)
+    return (next_run - now).total_seconds()
 
-# Run the scraping function initially
-scrape_and_save_data()
+# Async entry point for the bot's job queue: the blocking fetch, parse and SQLite writes
+# run in a worker thread so the bot's event loop stays responsive
+async def scrape_and_save_data_async():
+    await asyncio.to_thread(scrape_and_save_data)
 
-# Keep the script running to allow scheduling
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+# Scheduling lives in cydust.py; running this file directly performs a single scrape
+if __name__ == "__main__":
+    scrape_and_save_data()
\ No newline at end of file